@@ -1,12 +1,18 @@
 from __future__ import annotations
 import json
 import re
+import string
+import struct
+from dataclasses import dataclass
+from functools import lru_cache
 from os import path
-from typing import Optional, TypedDict
+from operator import attrgetter
+from typing import Iterable, Optional, TypedDict
 from wave import open as open_wave
 
 from phoneme import *
 
+@dataclass(slots=True)
 class OtoInfo:
     wav_file: str
     alias: str
@@ -28,37 +34,77 @@ class OtoEntryPhonemeInfo:
     phoneme_list: list[str]
     is_alternative: bool
 
+# Patterns used to parse oto aliases
+_RE_TRAILING_DIGITS = re.compile(r"[0-9]+$")
+_RE_HIRAGANA_ONLY = re.compile(r"^([ぁ-ゔァ-・]+)$")
+_RE_VR_VOWEL = re.compile(r"^([aiueonN])$")
+_RE_VV = re.compile(r"^([aiueoN]) ([aiueoN]|[あいうえおんアイウエオン])$")
+_RE_NV = re.compile(r"^n ([あいうえおんアイウエオン])$")
+_RE_NV_ROMAJI = re.compile(r"^n ([aiueo])$")
+_RE_VCV = re.compile(r"^([aiueoN]) ([a-zA-Z]+[aiueo]|[ぁ-ゔァ-・])$")
+_RE_VC = re.compile(r"^([aiueonN]) ([a-zA-Z]+)$")
+_RE_CV = re.compile(r"^([a-zA-Z ]+ ?[aiueonN]|[ぁ-ゔァ-・]+)$")
+
+# RIFF header, "fmt " chunk and "data" chunk header of a canonical PCM wav file
+_WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+
+def get_wav_length(wav_file: str) -> float:
+    """Returns the length of a wav file in milliseconds."""
+    with open(wav_file, 'rb') as f:
+        header = f.read(_WAV_HEADER.size)
+
+    if len(header) == _WAV_HEADER.size:
+        riff_id, _, wave_id, fmt_id, fmt_size, format_tag, channels, framerate, _, _, bits, data_id, data_size = _WAV_HEADER.unpack(header)
+        if (riff_id == b"RIFF" and wave_id == b"WAVE" and fmt_id == b"fmt " and fmt_size == 16 and format_tag == 1
+                and data_id == b"data" and channels > 0 and bits > 0 and framerate > 0):
+            nframes = data_size // (channels * ((bits + 7) // 8))
+            return nframes / framerate * 1000
+
+    # Not a canonical header, let the wave module walk the chunks
+    with open_wave(wav_file, 'rb') as wav:
+        wav_params = wav.getparams()
+        return wav_params.nframes / wav_params.framerate * 1000
+
+def write_text_lines(output_file: str, lines: Iterable[str], end: str = "\n"):
+    """Writes lines separated by newlines to a utf-8 text file, without joining them first."""
+    lines = iter(lines)
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write(next(lines, ""))
+        f.writelines("\n" + line for line in lines)
+        f.write(end)
+
 def read_oto(oto_file: str) -> dict[str, list[OtoInfo]]:
     """Reads an oto.ini file and returns a dictionary of lists of OtoInfo objects."""
     oto_dict: dict[str, list[OtoInfo]] = {}
     oto_path = path.dirname(oto_file)
+    # Resolved path and length of each wav file, the length is None if the file is missing
+    wav_info_cache: dict[str, tuple[str, Optional[float]]] = {}
     with open(oto_file, 'r', encoding="shift-jis") as f:
         for line in f:
             line = line.strip()
             if line == "" or line.startswith("#") or line.startswith(";"):
                 continue
             
-            wav_file, oto_params = line.split("=")
+            wav_file, _, oto_params = line.partition("=")
 
             if wav_file not in oto_dict:
                 oto_dict[wav_file] = []
 
-            wav_file_resolved = path.join(oto_path, wav_file)
-            if not path.isfile(wav_file_resolved):
+            if wav_file not in wav_info_cache:
+                wav_file_resolved = path.join(oto_path, wav_file)
+                wav_length = None
+                if path.isfile(wav_file_resolved):
+                    wav_length = get_wav_length(wav_file_resolved)
+
+                wav_info_cache[wav_file] = (wav_file_resolved, wav_length)
+
+            wav_file_resolved, wav_length = wav_info_cache[wav_file]
+            if wav_length is None:
                 print(f"Warning: Could not find wav file {wav_file_resolved}, skip this line.")
                 continue
-            
-            with open_wave(wav_file_resolved, 'rb') as wav:
-                wav_params = wav.getparams()
-                wav_length = wav_params.nframes / wav_params.framerate * 1000
-
-            alias, offset, consonant, cutoff, preutterance, overlap = oto_params.split(",")
 
-            offset = float(offset)
-            consonant = float(consonant)
-            cutoff = float(cutoff)
-            preutterance = float(preutterance)
-            overlap = float(overlap)
+            alias, *oto_values = oto_params.split(",", 5)
+            offset, consonant, cutoff, preutterance, overlap = map(float, oto_values)
             # Make all of the values absolute
             consonant = max(offset + consonant, 0)
             preutterance = max(offset + preutterance, 0)
@@ -69,20 +115,12 @@ def read_oto(oto_file: str) -> dict[str, list[OtoInfo]]:
             else:
                 cutoff = min(wav_length, offset + (-1 * cutoff))
 
-            oto_info = OtoInfo()
-            oto_info.wav_file = wav_file_resolved
-            oto_info.alias = alias
-            oto_info.offset = offset
-            oto_info.consonant = consonant
-            oto_info.cutoff = cutoff
-            oto_info.preutterance = preutterance
-            oto_info.overlap = overlap
-
+            oto_info = OtoInfo(wav_file_resolved, alias, offset, consonant, cutoff, preutterance, overlap)
             oto_dict[wav_file].append(oto_info)
 
     # Sort the oto list by preutterance
     for oto_list in oto_dict.values():
-        oto_list.sort(key=lambda x: x.preutterance)
+        oto_list.sort(key=attrgetter("preutterance"))
 
     return oto_dict
 
@@ -90,81 +128,112 @@ global hiragana_map
 with open("hiragana.json", "r", encoding="utf-8") as f:
     hiragana_map = json.load(f)
 
-    for item in hiragana_map:
-        item["phoneme"] = item["phoneme"].split(" ")
+# Lookup indexes, the first item wins when a kana or romaji is duplicated
+_kana_index: dict[str, JPhonemeMapItem] = {}
+_romaji_index: dict[str, JPhonemeMapItem] = {}
+for item in hiragana_map:
+    item["phoneme"] = item["phoneme"].split(" ")
+    _kana_index.setdefault(item["kana"], item)
+    _romaji_index.setdefault(item["romaji"], item)
 
 def get_hiragana_info(hiragana: str) -> Optional[JPhonemeMapItem]:
-    global hiragana_map
-    
-    for item in hiragana_map:
-        if item["kana"] == hiragana:
-            return item
-        
-    return None
+    return _kana_index.get(hiragana)
     
 def get_romaji_info(romaji: str) -> Optional[JPhonemeMapItem]:
-    global hiragana_map
-    
-    for item in hiragana_map:
-        if item["romaji"] == romaji:
-            return item
-        
-    return None
+    return _romaji_index.get(romaji)
+
+_ROMAJI_VOWELS = frozenset(["a", "i", "u", "e", "o", "n", "N"])
+_XSAMPA_VOWELS = frozenset(["a", "i", "M", "e", "o", "N\\"])
 
 def romaji_is_vowel(romaji: str) -> bool:
-    return romaji in ["a", "i", "u", "e", "o", "n", "N"]
+    return romaji in _ROMAJI_VOWELS
 
 def xsampa_is_vowel(xsampa: str) -> bool:
-    return xsampa in ["a", "i", "M", "e", "o", "N\\"]
+    return xsampa in _XSAMPA_VOWELS
+
+def is_hiragana_char(char: str) -> bool:
+    return "ぁ" <= char <= "ゔ" or "ァ" <= char <= "・"
+
+def is_romaji_char(char: str) -> bool:
+    return char.isascii() and char.isalpha()
+
+def split_phoneme_run(run: str, index: dict[str, JPhonemeMapItem], max_length: int) -> list[Optional[JPhonemeMapItem]]:
+    """Splits a run of characters into the longest items of a phoneme index, an unknown character becomes None."""
+    phoneme_list = []
+    run_len = len(run)
+    i = 0
+    while i < run_len:
+        for length in range(min(max_length, run_len - i), 0, -1):
+            item = index.get(run[i:i + length])
+            if item is not None:
+                break
+
+        phoneme_list.append(item)
+        i += length
+
+    return phoneme_list
+
+# Index and longest item used to split each script
+_script_indexes = {
+    "kana": (_kana_index, max(len(kana) for kana in _kana_index if all(map(is_hiragana_char, kana)))),
+    "romaji": (_romaji_index, max(len(romaji) for romaji in _romaji_index if all(map(is_romaji_char, romaji)))),
+}
+_RE_PHONEME_RUN = re.compile(r"(?P<kana>[ぁ-ゔァ-・]+)|(?P<romaji>[A-Za-z]+)")
 
 def get_phoneme_list_from_filename(filename: str) -> list[JPhonemeMapItem]:
-    if re.match(r"^[\_\-ぁ-ゔァ-・]+", filename):
-        # Hiragana
-        hiragana_list = re.findall(r"[ぁ-ゔァ-・][ぁぃぅぇぉゃゅょゎァィゥェォャュョヮ]?", filename)
-        return [get_hiragana_info(hiragana) for hiragana in hiragana_list]
-    elif re.match(r"^([a-zA-Z0-9\_\-])+", filename):
-        if "__" in filename: # Remove prompt phoneme
-            filename = filename[filename.index("__") + 2:]
-
-        filename = filename.replace("-", "_").strip("_")
-        # Romaji
-        romaji_list = re.findall(r"[a-zA-Z][a-zA-Z]?", filename)
-        return [get_romaji_info(romaji) for romaji in romaji_list]
-    
-    return []
+    if "__" in filename: # Remove prompt phoneme
+        filename = filename[filename.index("__") + 2:]
+
+    # Kana and romaji runs are split against their own index
+    phoneme_list = []
+    for matches in _RE_PHONEME_RUN.finditer(filename):
+        phoneme_list += split_phoneme_run(matches.group(), *_script_indexes[matches.lastgroup])
+
+    return phoneme_list
+
+_XSAMPA_ESCAPE_MAP = {"\\": "-", "/": "~", "?": "!", ":": ";", "<": "(", ">": ")"}
+# Upper case letters are not safe on case-insensitive file systems, they become "<lower case>#"
+_XSAMPA_ESCAPE_TABLE = str.maketrans({**_XSAMPA_ESCAPE_MAP, **{c: c.lower() + "#" for c in string.ascii_uppercase}})
+_XSAMPA_UNESCAPE_TABLE = str.maketrans({v: k for k, v in _XSAMPA_ESCAPE_MAP.items()})
+_RE_ESCAPED_UPPER = re.compile(r"([a-z])#")
 
 def escape_xsampa(xsampa: str) -> str:
     """Escapes xsampa to file name."""
     xsampa = xsampa.replace("Sil", "sil") # Sil is a special case
-    xsampa = xsampa.replace("\\", "-").replace("/", "~").replace("?", "!").replace(":", ";").replace("<", "(").replace(">", ")")
-    xsampa = re.sub(r"([A-Z])", lambda x : x.group(1).lower() + "#", xsampa)
-    return xsampa
+    return xsampa.translate(_XSAMPA_ESCAPE_TABLE)
 
 def unescape_xsampa(xsampa: str) -> str:
     """Unescapes xsampa from file name."""
-    xsampa = re.sub(r"([a-z])#", lambda x : x.group(1).upper(), xsampa)
-    xsampa = xsampa.replace("-", "\\").replace("~", "/").replace("!", "?").replace(";", ":").replace("(", "<").replace(")", ">")
-    return xsampa
+    xsampa = _RE_ESCAPED_UPPER.sub(lambda x : x.group(1).upper(), xsampa)
+    return xsampa.translate(_XSAMPA_UNESCAPE_TABLE)
+
+@lru_cache(maxsize=None)
+def get_alias_phoneme_info(item_alias: str) -> Optional[OtoEntryPhonemeInfo]:
+    """Returns phoneme info from an oto alias, or None if the alias is not recognized.
 
-def get_oto_entry_phoneme_info(oto_entry: OtoInfo) -> OtoEntryPhonemeInfo:
-    """Returns phoneme info from an OtoInfo object."""
-    item_alias = oto_entry.alias
+    The result is shared between calls and must not be modified. Exceptions are only raised for invalid items in the hiragana map.
+    """
 
     ret = OtoEntryPhonemeInfo()
 
-    if re.match(r"[0-9]+$", item_alias): # Alternate phoneme
+    if _RE_TRAILING_DIGITS.match(item_alias): # Alternate phoneme
         ret.is_alternative = True
-        item_alias = re.sub(r"[0-9]+$", "", item_alias)
+        item_alias = _RE_TRAILING_DIGITS.sub("", item_alias)
+
+    # Most aliases are romaji only, which rules out every kana pattern
+    is_ascii = item_alias.isascii()
+    # V-V, N-V, V-C-V and V-C aliases all start with "<vowel> ", skip their patterns for anything else
+    is_vowel_pair = len(item_alias) > 2 and item_alias[1] == " " and item_alias[0] in "aiueonN"
 
     if item_alias[0] == "-": # R-C-V?
         item_alias = item_alias[1:].strip()
-        if re.match(r"^([ぁ-ゔァ-・]+)$", item_alias): # Hiragana R-C-V:
+        if not is_ascii and _RE_HIRAGANA_ONLY.match(item_alias): # Hiragana R-C-V:
             hiragana = item_alias.replace(" ", "")
 
             phoneme_info = get_hiragana_info(hiragana)
 
             if phoneme_info is None:
-                raise Exception(f"[Hiragana R-C-V] Could not find phoneme info for {hiragana}")
+                return None
 
             if len(phoneme_info["phoneme"]) == 1: # R-C or R-V
                 if xsampa_is_vowel(phoneme_info["phoneme"][0]):
@@ -198,13 +267,13 @@ def get_oto_entry_phoneme_info(oto_entry: OtoInfo) -> OtoEntryPhonemeInfo:
             ret.phoneme_list = phoneme_info["phoneme"]
     elif item_alias[-1] == "-": # V-R
         item_alias = item_alias[:-1].strip()
-        if re.match(r"^([aiueonN])$", item_alias): # Romaji V-R
+        if _RE_VR_VOWEL.match(item_alias): # Romaji V-R
             romaji = item_alias.replace(" ", "")
 
             phoneme_info = get_romaji_info(romaji)
 
             if phoneme_info is None:
-                raise Exception(f"[Romaji VR] Could not find phoneme info for {romaji}")
+                return None
 
             if len(phoneme_info["phoneme"]) == 1:
                 ret.type = "vr"
@@ -214,43 +283,39 @@ def get_oto_entry_phoneme_info(oto_entry: OtoInfo) -> OtoEntryPhonemeInfo:
             else:
                 raise Exception(f"[Romaji VR] Invalid phoneme info for {romaji}")
         else:
-            raise Exception(f"[Romaji VR] Invalid phoneme info for {item_alias}")
-    elif re.match(r"^([aiueoN]) ([aiueoN]|[あいうえおんアイウエオン])$", item_alias): # V-V
-        matches = re.match(r"^([aiueoN]) ([aiueoN]|[あいうえおんアイウエオン])$", item_alias)
+            return None
+    elif is_vowel_pair and (matches := _RE_VV.match(item_alias)): # V-V
         first_vowel = matches.group(1)
         second_vowel = matches.group(2)
 
         first_vowel_info = get_romaji_info(first_vowel)
 
-        if re.match(r"[aiueoN]", second_vowel):
+        if second_vowel.isascii():
             second_vowel_info = get_romaji_info(second_vowel)
         else:
             second_vowel_info = get_hiragana_info(second_vowel)
 
         if first_vowel_info is None or second_vowel_info is None:
-            raise Exception(f"[Romaji VV] Could not find phoneme info for {item_alias}")
+            return None
         
         ret.type = "vv"
         ret.phoneme_info_list = [first_vowel_info, second_vowel_info]
         ret.phoneme_list = first_vowel_info["phoneme"] + second_vowel_info["phoneme"]
-    elif re.match(r"^n ([あいうえおんアイウエオン])$", item_alias): # N-V
-        matches = re.match(r"^n ([あいうえおんアイウエオン])$", item_alias)
-
+    elif is_vowel_pair and not is_ascii and (matches := _RE_NV.match(item_alias)): # N-V
         vowel = matches.group(1)
 
         n_info = get_hiragana_info("ん")
         vowel_info = get_hiragana_info(vowel)
 
         if n_info is None or vowel_info is None:
-            raise Exception(f"[Romaji NV] Could not find phoneme info for {item_alias}")
+            return None
         
         ret.type = "vv" # N-V is the same as V-V
         ret.phoneme_info_list = [n_info, vowel_info]
         ret.phoneme_list = n_info["phoneme"] + vowel_info["phoneme"]
-    elif re.match(r"^([aiueoN]) ([a-zA-Z]+[aiueo]|[ぁ-ゔァ-・])$", item_alias): # V-C-V
+    elif is_vowel_pair and _RE_VCV.match(item_alias): # V-C-V
         pass # TODO
-    elif re.match(r"^([aiueonN]) ([a-zA-Z]+)$", item_alias) and not re.match(r"^n ([aiueo])$", item_alias): # V-C
-        matches = re.match(r"^([aiueonN]) ([a-zA-Z]+)$", item_alias)
+    elif is_vowel_pair and is_ascii and (matches := _RE_VC.match(item_alias)) and not _RE_NV_ROMAJI.match(item_alias): # V-C
         vowel = matches.group(1)
         consonant = matches.group(2)
 
@@ -258,32 +323,19 @@ def get_oto_entry_phoneme_info(oto_entry: OtoInfo) -> OtoEntryPhonemeInfo:
         consonant_info = get_romaji_info(consonant)
 
         if vowel_info is None or consonant_info is None:
-            raise Exception(f"[Romaji VC] Could not find phoneme info for {item_alias}")
+            return None
         
         vowel_phoneme = vowel_info["phoneme"][0]
         consonant_phoneme = consonant_info["phoneme"][0]
         
         if vowel_phoneme == "N\\":
-            # N variants
-            if consonant_phoneme in ["n", "d", "d'", "t", "t'", "4", "4'", "dz", "dZ", "ts", "tS"]:
-                vowel_phoneme = "n"
-            elif consonant_phoneme in ["m", "m'", "p", "p'", "b", "b'"]:
-                vowel_phoneme = "m"
-            elif consonant_phoneme in ["g", "k"]:
-                vowel_phoneme = "N"
-            elif consonant_phoneme == "J":
-                vowel_phoneme = "J"
-            elif consonant_phoneme in ["g'", "k'"]:
-                vowel_phoneme = "N'"
-
-        vowel_info = vowel_info.copy()
-        vowel_info["phoneme"] = [vowel_phoneme]
-        
+            vowel_phoneme = n_variant_map.get(consonant_phoneme, vowel_phoneme)
+
         ret.type = "vc"
-        ret.phoneme_info_list = [vowel_info, consonant_info]
-        ret.phoneme_list = vowel_info["phoneme"] + consonant_info["phoneme"]
-    elif re.match(r"^([a-zA-Z ]+ ?[aiueonN]|[ぁ-ゔァ-・]+)$", item_alias): # C-V
-        if re.match(r"^[a-zA-Z ]+$", item_alias):
+        ret.phoneme_info_list = [vowel_info, consonant_info] # N variants only show up in phoneme_list
+        ret.phoneme_list = [vowel_phoneme] + consonant_info["phoneme"]
+    elif _RE_CV.match(item_alias): # C-V
+        if is_ascii:
             romaji = item_alias.replace(" ", "")
             phoneme_info = get_romaji_info(romaji)
         else:
@@ -291,44 +343,37 @@ def get_oto_entry_phoneme_info(oto_entry: OtoInfo) -> OtoEntryPhonemeInfo:
             phoneme_info = get_hiragana_info(hiragana)
 
         if phoneme_info is None:
-            raise Exception(f"[Romaji CV] Could not find phoneme info for {item_alias}")
+            return None
         
         ret.type = "cv"
         ret.phoneme_info_list = [phoneme_info]
         ret.phoneme_list = phoneme_info["phoneme"]
     else:
-        raise Exception(f"[Unknown Type] Invalid phoneme info for {item_alias}")
+        return None
     
     return ret
 
-def get_vowel_variants(vowel: str):
-    """Returns a list of vowel variants."""
-    vowel_variants = [vowel]
+def get_oto_entry_phoneme_info(oto_entry: OtoInfo) -> Optional[OtoEntryPhonemeInfo]:
+    """Returns phoneme info from an OtoInfo object, or None if its alias is not recognized."""
+    return get_alias_phoneme_info(oto_entry.alias)
 
-    for variant_list in vowel_variant_list:
-        if vowel in variant_list:
-            vowel_variants += variant_list
-    
-    # Deduplicate
-    unique_vowel_variants = []
-    for variant in vowel_variants:
-        if variant not in unique_vowel_variants:
-            unique_vowel_variants.append(variant)
+def _build_variant_index(variant_lists: list[list[str]]) -> dict[str, list[str]]:
+    """Maps each phoneme to itself followed by every phoneme sharing a variant list with it."""
+    variant_index: dict[str, list[str]] = {}
+    for variant_list in variant_lists:
+        for phoneme in variant_list:
+            variants = variant_index.get(phoneme, [phoneme])
+            variant_index[phoneme] = list(dict.fromkeys(variants + variant_list))
 
-    return unique_vowel_variants
+    return variant_index
 
-def get_consonant_variants(consonant: str):
-    """Returns a list of consonant variants."""
-    consonant_variants = [consonant]
+_vowel_variant_index = _build_variant_index(vowel_variant_list)
+_consonant_variant_index = _build_variant_index(consonant_variant_list)
 
-    for variant_list in consonant_variant_list:
-        if consonant in variant_list:
-            consonant_variants += variant_list
-    
-    # Deduplicate
-    unique_consonant_variants = []
-    for variant in consonant_variants:
-        if variant not in unique_consonant_variants:
-            unique_consonant_variants.append(variant)
+def get_vowel_variants(vowel: str):
+    """Returns a list of vowel variants, the list is shared between calls and must not be modified."""
+    return _vowel_variant_index.get(vowel) or [vowel]
 
-    return unique_consonant_variants
\ No newline at end of file
+def get_consonant_variants(consonant: str):
+    """Returns a list of consonant variants, the list is shared between calls and must not be modified."""
+    return _consonant_variant_index.get(consonant) or [consonant]
\ No newline at end of file
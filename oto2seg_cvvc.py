@@ -1,32 +1,56 @@
 from __future__ import annotations
 import math
 import re
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from os import path
-from typing import TypedDict
-from wave import open as open_wave
-from pydub import AudioSegment
+from wave import Wave_read, open as open_wave
 
 from functions import *
 from phoneme import *
 
+_UNVOICED = frozenset(unvoiced_consonant_list)
+_PLOSIVE = frozenset(plosive_consonant_list)
+
 class PhonemeStream:
     def __init__(self, item_list: list[JPhonemeMapItem]):
         self.item_list = [item for item in item_list if item]
-        self.item_len = len(item_list)
+        self.item_len = len(self.item_list)
         self.cv_seek = 0
         self.vc_seek = 0
 
+        # Sorted positions of each romaji, and of each (end of previous romaji, start of romaji) pair
+        self.cv_index: dict[str, list[int]] = {}
+        self.vc_index: dict[tuple[str, str], list[int]] = {}
+        for i, item in enumerate(self.item_list):
+            romaji = item["romaji"]
+            prev_romaji = self.item_list[i - 1]["romaji"]
+            self.cv_index.setdefault(romaji, []).append(i)
+            for suffix_start in range(0, len(prev_romaji) + 1):
+                for prefix_end in range(0, len(romaji) + 1):
+                    self.vc_index.setdefault((prev_romaji[suffix_start:], romaji[:prefix_end]), []).append(i)
+
+    def find_position(self, positions: list[int], seek: int) -> int:
+        """Returns the first position at or after seek, or the item count if there is none."""
+        if positions:
+            i = bisect_left(positions, seek)
+            if i < len(positions):
+                return positions[i]
+
+        return self.item_len
+
     def next_cv(self, romaji: str) -> bool:
-        while self.cv_seek < self.item_len:
-            finded_item = None
-            if self.item_list[self.cv_seek]["romaji"] == romaji:
-                finded_item = self.item_list[self.cv_seek]
-            else:
-                self.cv_seek += 1
-                self.vc_seek += 1
-
-            if finded_item:
-                return finded_item
+        if self.cv_seek >= self.item_len:
+            return False
+
+        position = self.find_position(self.cv_index.get(romaji), self.cv_seek)
+        # Both seeks skip the same items
+        self.vc_seek += position - self.cv_seek
+        self.cv_seek = position
+
+        if position < self.item_len:
+            return self.item_list[position]
             
         return False
     
@@ -35,109 +59,235 @@ class PhonemeStream:
         if vowel == "-" and self.vc_seek == 0: # Beginning consonant
             return self.item_list[0]
         
-        while self.vc_seek < self.item_len:
-            if self.item_len == 0:
-                self.item_len += 1
-            
-            finded_item = None
-            phoneme_item = self.item_list[self.vc_seek]
-            prev_phoneme_item = self.item_list[self.vc_seek - 1]
-            if prev_phoneme_item["romaji"].endswith(vowel) and phoneme_item["romaji"].startswith(consonant):
-                finded_item = self.item_list[self.vc_seek]
-            else:
-                self.vc_seek += 1
-                self.cv_seek += 1
-
-            if finded_item:
-                return finded_item
+        if self.vc_seek >= self.item_len:
+            return False
+
+        position = self.find_position(self.vc_index.get((vowel, consonant)), self.vc_seek)
+        # Both seeks skip the same items
+        self.cv_seek += position - self.vc_seek
+        self.vc_seek = position
+
+        if position < self.item_len:
+            return self.item_list[position]
             
         return False
 
+_RE_RCV_SA = re.compile(r"^- (s ?a|さ)")
+
 def detect_cvvc_initial_mode(oto_dict: dict[str, list[OtoInfo]]):
     """Detects the CV mode of an oto dictionary."""
     for oto_list in oto_dict.values():
         for oto_item in oto_list:
-            if re.match(r"^- (s ?a|さ)", oto_item.alias):
+            if _RE_RCV_SA.match(oto_item.alias):
                 return "rcv"
     
     return "rccv"
 
-class ArticulationSegmentInfo(TypedDict):
+@dataclass(slots=True)
+class ArticulationSegmentInfo:
     type: str
-    phonemes: list[str, str]
-    boundaries: list[list[str, float, float]]
+    phonemes: list[str]
+    boundaries: list[float]
 
+@dataclass(slots=True)
 class SegmentInfo:
-    wav_offset: float
-    wav_cutoff: float
-    phoneme_list: list[list[str, float]]
-    art_seg_list: list[ArticulationSegmentInfo]
-
-    def copy(self):
-        new_seg_info = SegmentInfo()
-        new_seg_info.wav_offset = self.wav_offset
-        new_seg_info.wav_cutoff = self.wav_cutoff
-        new_seg_info.phoneme_list = []
-
-        for phoneme in self.phoneme_list:
-            new_seg_info.phoneme_list.append(phoneme.copy())
-
-        new_seg_info.art_seg_list = []
-
-        for art_seg in self.art_seg_list:
-            new_art_seg = ArticulationSegmentInfo()
-            new_art_seg["type"] = art_seg["type"]
-            new_art_seg["phonemes"] = art_seg["phonemes"].copy()
-            new_art_seg["boundaries"] = art_seg["boundaries"].copy()
-            new_seg_info.art_seg_list.append(new_art_seg)
-
-        return new_seg_info
-    
-    def replace_phoneme(self, old_phonemes: list[str], new_phonemes: list[str]):
-        new_seg_info = self.copy()
-
-        for i in range(0, len(new_seg_info.phoneme_list)):
-            phoneme = new_seg_info.phoneme_list[i]
-            if phoneme[0] in old_phonemes:
-                phoneme[0] = new_phonemes[old_phonemes.index(phoneme[0])]
+    wav_offset: float = 0.0
+    wav_cutoff: float = 0.0
+    phoneme_list: list[list[str, float, float]] = field(default_factory=list)
+    art_seg_list: list[ArticulationSegmentInfo] = field(default_factory=list)
 
-        for art_seg in new_seg_info.art_seg_list:
-            for i in range(0, len(art_seg["phonemes"])):
-                phoneme = art_seg["phonemes"][i]
-                if phoneme in old_phonemes:
-                    art_seg["phonemes"][i] = new_phonemes[old_phonemes.index(phoneme)]
-
-        return new_seg_info
+    def replace_phoneme(self, old_phonemes: list[str], new_phonemes: list[str]):
+        # The first occurrence of an old phoneme wins
+        phoneme_map = {}
+        for old_phoneme, new_phoneme in zip(old_phonemes, new_phonemes):
+            phoneme_map.setdefault(old_phoneme, new_phoneme)
+
+        # Boundaries are never modified after generation, so they are shared with this segment
+        return SegmentInfo(
+            self.wav_offset,
+            self.wav_cutoff,
+            [[phoneme_map.get(phoneme[0], phoneme[0]), *phoneme[1:]] for phoneme in self.phoneme_list],
+            [
+                ArticulationSegmentInfo(
+                    art_seg.type,
+                    [phoneme_map.get(phoneme, phoneme) for phoneme in art_seg.phonemes],
+                    art_seg.boundaries,
+                )
+                for art_seg in self.art_seg_list
+            ],
+        )
 
 
 def get_segment_file_name(seg_info: SegmentInfo):
-    if len(seg_info.art_seg_list) == 2 and seg_info.art_seg_list[0]["type"] == "rc" and seg_info.art_seg_list[1]["type"] == "cv":
+    if len(seg_info.art_seg_list) == 2 and seg_info.art_seg_list[0].type == "rc" and seg_info.art_seg_list[1].type == "cv":
         prefix = "rcv_"
     elif len(seg_info.art_seg_list) == 1:
-        prefix = seg_info.art_seg_list[0]["type"] + "_"
+        prefix = seg_info.art_seg_list[0].type + "_"
     else:
         prefix = "unknown_"
 
     phonemes = [escape_xsampa(item[0]) for item in seg_info.phoneme_list]
     return prefix + "_".join(phonemes)
 
-def quantize_boundary(boundaries: list[float]) -> list[float]:
+def quantize_boundary_triple(begin: float, middle: float, end: float) -> list[float]:
+    """Moves begin and middle back to a sample and end forward, then pulls back a boundary closer than 10 ms to the next."""
     sample_rate = 44100
-    n_boundary = len(boundaries)
-    for i in range(0, n_boundary):
-        if i == 0:
-            boundaries[i] = math.floor(boundaries[i] / 1000 * sample_rate) * 1000 / sample_rate
-        elif i == n_boundary - 1:
-            boundaries[i] = math.ceil(boundaries[i] / 1000 * sample_rate) * 1000 / sample_rate
-        else:
-            boundaries[i] = math.floor(boundaries[i] / 1000 * sample_rate) * 1000 / sample_rate
+    begin = math.floor(begin / 1000 * sample_rate) * 1000 / sample_rate
+    middle = math.floor(middle / 1000 * sample_rate) * 1000 / sample_rate
+    end = math.ceil(end / 1000 * sample_rate) * 1000 / sample_rate
 
     min_length = 10
-    for i in range(1, n_boundary):
-        if boundaries[i] - boundaries[i - 1] < min_length:
-            boundaries[i - 1] = boundaries[i] - min_length
-
-    return boundaries
+    if middle - begin < min_length:
+        begin = middle - min_length
+    if end - middle < min_length:
+        middle = end - min_length
+
+    return [begin, middle, end]
+
+def generate_rcv_segment_info(oto_item: OtoInfo, entry_phoneme_info: OtoEntryPhonemeInfo) -> SegmentInfo:
+    return SegmentInfo(
+        wav_offset=oto_item.offset,
+        wav_cutoff=oto_item.preutterance,
+        phoneme_list=[
+            ["Sil", oto_item.offset - 20, oto_item.offset],
+            [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.preutterance],
+            # [phoneme_info["phoneme"][1], oto_item.preutterance, oto_item.cutoff],
+        ],
+        art_seg_list=[
+            ArticulationSegmentInfo(
+                type="rc",
+                phonemes=["Sil", entry_phoneme_info.phoneme_list[0]],
+                boundaries=quantize_boundary_triple(oto_item.offset - 20, oto_item.offset, oto_item.overlap),
+            ),
+        ],
+    )
+
+def generate_rv_segment_info(oto_item: OtoInfo, entry_phoneme_info: OtoEntryPhonemeInfo) -> SegmentInfo:
+    return SegmentInfo(
+        wav_offset=oto_item.offset,
+        wav_cutoff=oto_item.cutoff,
+        phoneme_list=[
+            ["Sil", oto_item.preutterance - 20, oto_item.preutterance],
+            [entry_phoneme_info.phoneme_list[0], oto_item.preutterance, oto_item.cutoff],
+        ],
+        art_seg_list=[
+            ArticulationSegmentInfo(
+                type="rv",
+                phonemes=["Sil", entry_phoneme_info.phoneme_list[0]],
+                boundaries=quantize_boundary_triple(oto_item.preutterance - 20, oto_item.preutterance, oto_item.consonant),
+            )
+        ],
+    )
+
+def generate_rc_segment_info(oto_item: OtoInfo, entry_phoneme_info: OtoEntryPhonemeInfo) -> SegmentInfo:
+    if entry_phoneme_info.phoneme_list[0] in _PLOSIVE:
+        consonant_start = oto_item.consonant
+    else:
+        consonant_start = oto_item.offset
+
+    return SegmentInfo(
+        wav_offset=oto_item.offset,
+        wav_cutoff=oto_item.cutoff,
+        phoneme_list=[
+            ["Sil", consonant_start - 20, consonant_start],
+            [entry_phoneme_info.phoneme_list[0], consonant_start, oto_item.cutoff],
+        ],
+        art_seg_list=[
+            ArticulationSegmentInfo(
+                type="rc",
+                phonemes=["Sil", entry_phoneme_info.phoneme_list[0]],
+                boundaries=quantize_boundary_triple(consonant_start - 20, consonant_start, oto_item.cutoff),
+            )
+        ],
+    )
+
+def generate_vv_segment_info(oto_item: OtoInfo, entry_phoneme_info: OtoEntryPhonemeInfo) -> SegmentInfo:
+    return SegmentInfo(
+        wav_offset=oto_item.offset,
+        wav_cutoff=oto_item.cutoff,
+        phoneme_list=[
+            [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.preutterance],
+            [entry_phoneme_info.phoneme_list[1], oto_item.preutterance, oto_item.consonant],
+        ],
+        art_seg_list=[
+            ArticulationSegmentInfo(
+                type="vv",
+                phonemes=[entry_phoneme_info.phoneme_list[0], entry_phoneme_info.phoneme_list[1]],
+                boundaries=quantize_boundary_triple(oto_item.offset, oto_item.preutterance, oto_item.consonant),
+            )
+        ],
+    )
+
+def generate_cv_segment_info(oto_item: OtoInfo, entry_phoneme_info: OtoEntryPhonemeInfo) -> SegmentInfo:
+    consonant = entry_phoneme_info.phoneme_list[0]
+    if consonant in _PLOSIVE:
+        consonant_start = oto_item.overlap
+    elif oto_item.overlap > oto_item.offset:
+        consonant_start = oto_item.offset + ((oto_item.overlap - oto_item.offset) / 2)
+    else:
+        consonant_start = oto_item.offset
+
+    return SegmentInfo(
+        wav_offset=oto_item.offset,
+        wav_cutoff=oto_item.cutoff,
+        phoneme_list=[
+            [entry_phoneme_info.phoneme_list[0], consonant_start, oto_item.preutterance],
+            [entry_phoneme_info.phoneme_list[1], oto_item.preutterance, oto_item.consonant],
+        ],
+        art_seg_list=[
+            ArticulationSegmentInfo(
+                type="cv",
+                phonemes=[entry_phoneme_info.phoneme_list[0], entry_phoneme_info.phoneme_list[1]],
+                boundaries=quantize_boundary_triple(consonant_start, oto_item.preutterance, oto_item.consonant),
+            )
+        ],
+    )
+
+def generate_vc_segment_info(oto_item: OtoInfo, entry_phoneme_info: OtoEntryPhonemeInfo) -> SegmentInfo:
+    consonant_end = oto_item.consonant + ((oto_item.cutoff - oto_item.consonant) / 2)
+
+    return SegmentInfo(
+        wav_offset=oto_item.offset,
+        wav_cutoff=oto_item.cutoff,
+        phoneme_list=[
+            [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.preutterance],
+            [entry_phoneme_info.phoneme_list[1], oto_item.preutterance, consonant_end],
+        ],
+        art_seg_list=[
+            ArticulationSegmentInfo(
+                type="vc",
+                phonemes=[entry_phoneme_info.phoneme_list[0], entry_phoneme_info.phoneme_list[1]],
+                boundaries=quantize_boundary_triple(oto_item.offset, oto_item.preutterance, consonant_end),
+            )
+        ],
+    )
+
+def generate_vr_segment_info(oto_item: OtoInfo, entry_phoneme_info: OtoEntryPhonemeInfo) -> SegmentInfo:
+    return SegmentInfo(
+        wav_offset=oto_item.offset,
+        wav_cutoff=oto_item.cutoff,
+        phoneme_list=[
+            [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.preutterance],
+            ["Sil", oto_item.preutterance, oto_item.preutterance + 20],
+        ],
+        art_seg_list=[
+            ArticulationSegmentInfo(
+                type="vr",
+                phonemes=[entry_phoneme_info.phoneme_list[0], "Sil"],
+                boundaries=quantize_boundary_triple(oto_item.overlap, oto_item.preutterance, oto_item.preutterance + 20),
+            )
+        ],
+    )
+
+_segment_info_generators = {
+    "rcv": generate_rcv_segment_info,
+    "rv": generate_rv_segment_info,
+    "rc": generate_rc_segment_info,
+    "vv": generate_vv_segment_info,
+    "cv": generate_cv_segment_info,
+    "vc": generate_vc_segment_info,
+    "vr": generate_vr_segment_info,
+}
 
 def generate_articulation_segment_info(oto_list: list[OtoInfo], cvvc_initial_mode: str, wav_length: float) -> list[SegmentInfo]:
     seg_info_list: list[SegmentInfo] = []
@@ -145,199 +295,70 @@ def generate_articulation_segment_info(oto_list: list[OtoInfo], cvvc_initial_mod
     for oto_item in oto_list:
         try:
             entry_phoneme_info = get_oto_entry_phoneme_info(oto_item)
-            
-            seg_info = SegmentInfo()
-            seg_info.wav_offset = oto_item.offset
-            seg_info.wav_cutoff = oto_item.cutoff
-            if entry_phoneme_info.type == "rcv":
-                seg_info.wav_cutoff = oto_item.preutterance
-
-                seg_info.phoneme_list = [
-                    ["Sil", oto_item.offset - 20, oto_item.offset],
-                    [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.preutterance],
-                    # [phoneme_info["phoneme"][1], oto_item.preutterance, oto_item.cutoff],
-                ]
-                seg_info.art_seg_list = [
-                    {
-                        "type": "rc",
-                        "phonemes": ["Sil", entry_phoneme_info.phoneme_list[0]],
-                        "boundaries": quantize_boundary([oto_item.offset - 20, oto_item.offset, oto_item.overlap]),
-                    },
-                ]
-            elif entry_phoneme_info.type == "rv":
-                seg_info.phoneme_list = [
-                    ["Sil", oto_item.preutterance - 20, oto_item.preutterance],
-                    [entry_phoneme_info.phoneme_list[0], oto_item.preutterance, oto_item.cutoff],
-                ]
-                seg_info.art_seg_list = [
-                    {
-                        "type": "rv",
-                        "phonemes": ["Sil", entry_phoneme_info.phoneme_list[0]],
-                        "boundaries": quantize_boundary([oto_item.preutterance - 20, oto_item.preutterance, oto_item.consonant]),
-                    }
-                ]
-            elif entry_phoneme_info.type == "rc":
-                if entry_phoneme_info.phoneme_list[0] in plosive_consonant_list:
-                    consonant_start = oto_item.consonant
-                else:
-                    consonant_start = oto_item.offset
-
-                seg_info.phoneme_list = [
-                    ["Sil", consonant_start - 20, consonant_start],
-                    [entry_phoneme_info.phoneme_list[0], consonant_start, oto_item.cutoff],
-                ]
-                seg_info.art_seg_list = [
-                    {
-                        "type": "rc",
-                        "phonemes": ["Sil", entry_phoneme_info.phoneme_list[0]],
-                        "boundaries": quantize_boundary([consonant_start - 20, consonant_start, oto_item.cutoff]),
-                    }
-                ]
-            elif entry_phoneme_info.type == "vv":
-                seg_info.phoneme_list = [
-                    [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.preutterance],
-                    [entry_phoneme_info.phoneme_list[1], oto_item.preutterance, oto_item.consonant],
-                ]
-
-                seg_info.art_seg_list = [
-                    {
-                        "type": "vv",
-                        "phonemes": [entry_phoneme_info.phoneme_list[0], entry_phoneme_info.phoneme_list[1]],
-                        "boundaries": quantize_boundary([oto_item.offset, oto_item.preutterance, oto_item.consonant]),
-                    }
-                ]
-            elif entry_phoneme_info.type == "cv":
-                consonant = entry_phoneme_info.phoneme_list[0]
-                if consonant in plosive_consonant_list:
-                    consonant_start = oto_item.overlap
-                elif oto_item.overlap > oto_item.offset:
-                    consonant_start = oto_item.offset + ((oto_item.overlap - oto_item.offset) / 2)
-                else:
-                    consonant_start = oto_item.offset
-
-                seg_info.phoneme_list = [
-                    [entry_phoneme_info.phoneme_list[0], consonant_start, oto_item.preutterance],
-                    [entry_phoneme_info.phoneme_list[1], oto_item.preutterance, oto_item.consonant],
-                ]
-
-                seg_info.art_seg_list = [
-                    {
-                        "type": "cv",
-                        "phonemes": [entry_phoneme_info.phoneme_list[0], entry_phoneme_info.phoneme_list[1]],
-                        "boundaries": quantize_boundary([consonant_start, oto_item.preutterance, oto_item.consonant]),
-                    }
-                ]
-            elif entry_phoneme_info.type == "vc":
-                consonant = entry_phoneme_info.phoneme_list[1]
-                consonant_end = oto_item.consonant + ((oto_item.cutoff - oto_item.consonant) / 2)
-                
-                seg_info.phoneme_list = [
-                    [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.preutterance],
-                    [entry_phoneme_info.phoneme_list[1], oto_item.preutterance, consonant_end],
-                ]
-
-                seg_info.art_seg_list = [
-                    {
-                        "type": "vc",
-                        "phonemes": [entry_phoneme_info.phoneme_list[0], entry_phoneme_info.phoneme_list[1]],
-                        "boundaries": quantize_boundary([oto_item.offset, oto_item.preutterance, consonant_end]),
-                    }
-                ]
-            elif entry_phoneme_info.type == "vr":
-                seg_info.phoneme_list = [
-                    [entry_phoneme_info.phoneme_list[0], oto_item.offset, oto_item.preutterance],
-                    ["Sil", oto_item.preutterance, oto_item.preutterance + 20],
-                ]
-
-                seg_info.art_seg_list = [
-                    {
-                        "type": "vr",
-                        "phonemes": [entry_phoneme_info.phoneme_list[0], "Sil"],
-                        "boundaries": quantize_boundary([oto_item.overlap, oto_item.preutterance, oto_item.preutterance + 20]),
-                    }
-                ]
-            else:
+            if entry_phoneme_info is None:
+                print("Warning: Unknown alias %s, skip this line." % (oto_item.alias,))
+                continue
+
+            segment_info_generator = _segment_info_generators.get(entry_phoneme_info.type)
+            if segment_info_generator is None:
                 raise Exception("Unknown phoneme type: %s" % (entry_phoneme_info.type,))
 
-            seg_info_list.append(seg_info)
+            seg_info_list.append(segment_info_generator(oto_item, entry_phoneme_info))
         except Exception as e:
             print("Warning: Failed to parse %s: %s" % (oto_item.alias, e))
     
     return seg_info_list
 
-def generate_articulation_seg_file(phoneme_list: list[list], cutoff_pos: int, wav_length: int) -> str:
-    content = [
-        "nPhonemes %d" % (len(phoneme_list) + 2,), # Add 2 Sil
+def generate_articulation_lines(phoneme_list: list[list], art_seg_list: list[ArticulationSegmentInfo], cutoff_pos: float, wav_length: float, wav_samples: int, time_delta: float) -> tuple[list[str], list[str], list[list[str]]]:
+    """Generates the lines of the seg, trans and as files together, phoneme times and boundaries are shifted by time_delta."""
+    seg_lines = [
+        f"nPhonemes {len(phoneme_list) + 2}", # Add 2 Sil
         "articulationsAreStationaries = 0",
         "phoneme		BeginTime		EndTime",
-        "==================================================="
+        "===================================================",
+        f"Sil\t\t0.000000\t\t{(phoneme_list[0][1] + time_delta) / 1000:.6f}",
     ]
-
-    content.append("%s\t\t%.6f\t\t%.6f" % ("Sil", 0, phoneme_list[0][1] / 1000))
-
-    for i in range(0, len(phoneme_list)):
-        phoneme_info = phoneme_list[i]
-        phoneme_name = phoneme_info[0]
-        begin_time = phoneme_info[1] / 1000
-        if i == len(phoneme_list) - 1:
-            end_time = cutoff_pos / 1000
-        else:
-            end_time = phoneme_list[i + 1][1] / 1000
-
-        content.append("%s\t\t%.6f\t\t%.6f" % (phoneme_name, begin_time, end_time))
-
-    content.append("%s\t\t%.6f\t\t%.6f" % ("Sil", cutoff_pos / 1000, wav_length / 1000))
-
-    return "\n".join(content) + "\n"
-
-def generate_articulation_trans_file(seg_info: list[list]) -> str:
-    content = []
-
-    phoneme_list = []
-    for i in range(0, len(seg_info)):
-        phoneme_list.append(seg_info[i][0])
-    
-    content.append(" ".join(phoneme_list))
-
-    for i in range(0, len(seg_info) - 1):
-        content.append("[%s %s]" % (seg_info[i][0], seg_info[i + 1][0]))
-
-    return "\n".join(content)
-
-def generate_articulation_as_files(art_seg_list: list[ArticulationSegmentInfo], wav_samples: int) -> str:
-    as_content_list = []
+    trans_phonemes = []
+    trans_lines = [""]
+
+    # Each phoneme ends where the next one begins, and the last one ends at the cutoff
+    prev_phoneme = None
+    prev_begin_time = 0
+    for phoneme_info in phoneme_list:
+        phoneme = phoneme_info[0]
+        begin_time = phoneme_info[1] + time_delta
+        if prev_phoneme is not None:
+            seg_lines.append(f"{prev_phoneme}\t\t{prev_begin_time / 1000:.6f}\t\t{begin_time / 1000:.6f}")
+            trans_lines.append(f"[{prev_phoneme} {phoneme}]")
+
+        trans_phonemes.append(phoneme)
+        prev_phoneme = phoneme
+        prev_begin_time = begin_time
+
+    if prev_phoneme is not None:
+        seg_lines.append(f"{prev_phoneme}\t\t{prev_begin_time / 1000:.6f}\t\t{cutoff_pos / 1000:.6f}")
+
+    seg_lines.append(f"Sil\t\t{cutoff_pos / 1000:.6f}\t\t{wav_length / 1000:.6f}")
+    trans_lines[0] = " ".join(trans_phonemes)
+
+    as_lines_list = []
     for art_seg_info in art_seg_list:
-        content = [
+        voiced_str = ["false" if phoneme in _UNVOICED else "true" for phoneme in art_seg_info.phonemes]
+        as_lines_list.append([
             "nphone art segmentation",
             "{",
-            '\tphns: ["' + ('", "'.join(art_seg_info["phonemes"])) + '"];',
+            '\tphns: ["' + ('", "'.join(art_seg_info.phonemes)) + '"];',
             '\tcut offset: 0;',
-            '\tcut length: %d;' % wav_samples,
-        ]
-
-        boundaries_str = [("%.9f" % (item / 1000)) for item in art_seg_info["boundaries"]]
-        content.append('\tboundaries: [' + ', '.join(boundaries_str) + '];')
-        
-        content.append('\trevised: false;')
-        
-        voiced_str = []
-        for phoneme in art_seg_info["phonemes"]:
-            if phoneme in unvoiced_consonant_list:
-                voiced_str.append("false")
-            else:
-                voiced_str.append("true")
-
-        content.append('\tvoiced: [' + ', '.join(voiced_str) + '];')
-
-        content.append("};")
-        content.append("")
-
-        as_content_list.append("\n".join(content))
-
-    return as_content_list
+            f'\tcut length: {wav_samples};',
+            '\tboundaries: [' + ', '.join(f"{(item + time_delta) / 1000:.9f}" for item in art_seg_info.boundaries) + '];',
+            '\trevised: false;',
+            '\tvoiced: [' + ', '.join(voiced_str) + '];',
+            "};",
+        ])
 
+    return seg_lines, trans_lines, as_lines_list
 
-def generate_articulation_files(wav_file: str, seg_info: SegmentInfo, output_dir: str) -> str:
+def generate_articulation_files(input_wav: Wave_read, wav_length: float, seg_info: SegmentInfo, output_dir: str) -> str:
     bleed_time = 100
 
     file_name = get_segment_file_name(seg_info)
@@ -360,63 +381,56 @@ def generate_articulation_files(wav_file: str, seg_info: SegmentInfo, output_dir
     relative_wav_offset = seg_info.wav_offset + time_delta
     relative_wav_cutoff = seg_info.wav_cutoff + time_delta
 
-    phoneme_list = []
-    for phoneme in seg_info.phoneme_list:
-        phoneme_list.append([
-            phoneme[0],
-            phoneme[1] + time_delta,
-            phoneme[2] + time_delta,
-        ])
-    
-    art_seg_list = []
-    for art_seg in seg_info.art_seg_list:
-        art_seg_list.append({
-            "type": art_seg["type"],
-            "phonemes": art_seg["phonemes"],
-            "boundaries": [boundary + time_delta for boundary in art_seg["boundaries"]],
-        })
-
-    with open_wave(wav_file, 'rb') as wav:
-        wav_length = wav.getnframes() / wav.getframerate() * 1000
-
     if seg_info.wav_cutoff + bleed_time > wav_length:
         append_silent_end = seg_info.wav_cutoff + bleed_time - wav_length
 
-    # Generate trans file
-    trans_content = generate_articulation_trans_file(phoneme_list)
-    output_trans_file = path.join(output_dir, file_name + ".trans")
-    with open(output_trans_file, "w", encoding="utf-8") as f:
-        f.write(trans_content)
-        
     # Generate wav file
-    input_sound = AudioSegment.from_wav(wav_file)
     wav_start_time = max(0, seg_info.wav_offset - bleed_time)
     wav_end_time = min(wav_length, seg_info.wav_cutoff + bleed_time)
-    output_sound: AudioSegment = input_sound[wav_start_time:wav_end_time]
+    wav_params = input_wav.getparams()
+    frame_width = wav_params.nchannels * wav_params.sampwidth
+    # 8-bit wav is unsigned, its silence is 0x80 rather than 0
+    silent_frame = (b"\x80" if wav_params.sampwidth == 1 else b"\0") * frame_width
+
+    start_frame = min(int(wav_start_time * wav_params.framerate / 1000), wav_params.nframes)
+    end_frame = min(int(wav_end_time * wav_params.framerate / 1000), wav_params.nframes)
+    input_wav.setpos(start_frame)
+    output_frames = input_wav.readframes(max(0, end_frame - start_frame))
 
     if append_silent_start > 0:
-        output_sound = AudioSegment.silent(duration=append_silent_start) + output_sound
+        output_frames = silent_frame * int(append_silent_start * wav_params.framerate / 1000) + output_frames
     if append_silent_end > 0:
-        output_sound = output_sound + AudioSegment.silent(duration=append_silent_end)
+        output_frames = output_frames + silent_frame * int(append_silent_end * wav_params.framerate / 1000)
 
     output_wav_file = path.join(output_dir, file_name + ".wav")
-    output_sound.export(output_wav_file, format="wav")
+    with open_wave(output_wav_file, "wb") as output_wav:
+        output_wav.setparams(wav_params)
+        output_wav.writeframes(output_frames)
+
+    output_wav_frames = len(output_frames) // frame_width
+    output_wav_length = output_wav_frames / wav_params.framerate * 1000
+
+    seg_lines, trans_lines, as_lines_list = generate_articulation_lines(
+        seg_info.phoneme_list,
+        seg_info.art_seg_list,
+        relative_wav_cutoff,
+        output_wav_length,
+        output_wav_frames,
+        time_delta,
+    )
 
-    output_wav_length = output_sound.duration_seconds * 1000
-    output_wav_frames = output_sound.frame_count()
+    # Generate trans file
+    output_trans_file = path.join(output_dir, file_name + ".trans")
+    write_text_lines(output_trans_file, trans_lines, end="")
 
     # Generate seg file
-    seg_content = generate_articulation_seg_file(phoneme_list, relative_wav_cutoff, output_wav_length)
     output_seg_file = path.join(output_dir, file_name + ".seg")
-    with open(output_seg_file, "w", encoding="utf-8") as f:
-        f.write(seg_content)
+    write_text_lines(output_seg_file, seg_lines)
         
     # Generate as file
-    as_content_list = generate_articulation_as_files(art_seg_list, output_wav_frames)
-    for i in range(0, len(as_content_list)):
+    for i in range(0, len(as_lines_list)):
         output_as_file = path.join(output_dir, file_name + ".as%d" % i)
-        with open(output_as_file, "w", encoding="utf-8") as f:
-            f.write(as_content_list[i])
+        write_text_lines(output_as_file, as_lines_list[i])
 
 def find_alternative_vc(vc_name: str, vc_hit_list: map) -> str:
     """Finds an alternative VC for a VC name."""
@@ -444,10 +458,42 @@ def find_alternative_vr(vowel: str, vr_hit_list: map) -> str:
 
     return ""
 
+def generate_wav_articulation_files(work_item: tuple[str, float, list[SegmentInfo], str]):
+    """Generates the articulation files of the segments of one wav file, in a worker process."""
+    wav_file, wav_length, seg_info_list, output_dir = work_item
+
+    # Open the wav file once for all of its segments
+    with open_wave(wav_file, "rb") as input_wav:
+        for seg_info in seg_info_list:
+            generate_articulation_files(input_wav, wav_length, seg_info, output_dir)
+
+def run_articulation_work(seg_work_list: list[tuple[str, float, SegmentInfo]], output_dir: str):
+    """Generates the articulation files of (wav file, wav length, segment) items, one wav file per work item."""
+    # Segments with the same file name overwrite each other, keep the last one like a sequential run
+    seg_work_map = {}
+    for wav_file, wav_length, seg_info in seg_work_list:
+        file_name = get_segment_file_name(seg_info)
+        seg_work_map.pop(file_name, None)
+        seg_work_map[file_name] = (wav_file, wav_length, seg_info)
+
+    wav_work_map = {}
+    for wav_file, wav_length, seg_info in seg_work_map.values():
+        if wav_file not in wav_work_map:
+            wav_work_map[wav_file] = (wav_file, wav_length, [], output_dir)
+        wav_work_map[wav_file][2].append(seg_info)
+
+    if len(wav_work_map) == 0:
+        return
+
+    with ProcessPoolExecutor() as executor:
+        list(executor.map(generate_wav_articulation_files, wav_work_map.values(), chunksize=4))
+
 def generate_articulation_from_oto(oto_dict: dict[str, list[OtoInfo]], cvvc_initial_mode: str, output_dir: str) -> str:
     """Converts an oto.ini dictionary to a .seg file."""
     cvvc_map = {}
-    full_seg_info_list = []
+    seg_work_list = []
+    # Length of each wav file by absolute path, several oto names can resolve to the same file
+    wav_length_cache: dict[str, float] = {}
     
     for wav_file, oto_list in oto_dict.items():
         if len(oto_list) == 0:
@@ -455,41 +501,43 @@ def generate_articulation_from_oto(oto_dict: dict[str, list[OtoInfo]], cvvc_init
 
         base_name = path.splitext(path.basename(wav_file))[0]
         wav_file_resolved = oto_list[0].wav_file
-        with open_wave(wav_file_resolved, 'rb') as wav:
-            wav_params = wav.getparams()
-            wav_length = wav_params.nframes / wav_params.framerate * 1000
+        wav_key = path.abspath(wav_file_resolved)
+        wav_length = wav_length_cache.get(wav_key)
+        if wav_length is None:
+            wav_length = get_wav_length(wav_key)
+            wav_length_cache[wav_key] = wav_length
 
         seg_info_list = generate_articulation_segment_info(oto_list, cvvc_initial_mode, wav_length)
-        
+        if len(seg_info_list) == 0:
+            continue
+
         for seg_info in seg_info_list:
-            generate_articulation_files(wav_file_resolved, seg_info, output_dir)
+            seg_work_list.append((wav_file_resolved, wav_length, seg_info))
 
             for art_seg in seg_info.art_seg_list:
-                if art_seg["type"] == "vc" or art_seg["type"] == "cv":
-                    cvvc_map[" ".join(art_seg["phonemes"])] = {
+                if art_seg.type == "vc" or art_seg.type == "cv":
+                    cvvc_map[" ".join(art_seg.phonemes)] = {
                         "seg_info": seg_info,
-                        "wav_file": wav_file_resolved
+                        "wav_file": wav_file_resolved,
+                        "wav_length": wav_length,
                     }
-                elif art_seg["type"] == "vr":
-                    cvvc_map[art_seg["phonemes"][0] + " -"] = {
+                elif art_seg.type == "vr":
+                    cvvc_map[art_seg.phonemes[0] + " -"] = {
                         "seg_info": seg_info,
-                        "wav_file": wav_file_resolved
+                        "wav_file": wav_file_resolved,
+                        "wav_length": wav_length,
                     }
 
-    vc_miss_list = []
-    vr_miss_list = []
-    for vc in vc_list:
-        if vc not in cvvc_map:
-            vc_miss_list.append(vc)
+    run_articulation_work(seg_work_list, output_dir)
 
-    for vr in vr_list:
-        vr_name = vr + " -"
-        if vr_name not in cvvc_map:
-            vr_miss_list.append(vr)
+    vc_miss_list = [vc for vc in vc_list if vc not in cvvc_map]
+    vr_miss_list = [vr for vr in vr_list if vr + " -" not in cvvc_map]
 
     print("Missing VC: " + ", ".join(vc_miss_list))
     print("Missing VR: " + ", ".join(vr_miss_list))
 
+    alternative_work_list = []
+
     # Generate missing VC from alternative consonant
     for vc_name in vc_miss_list:
         vowel, consonant = vc_name.split(" ", 1)
@@ -503,7 +551,7 @@ def generate_articulation_from_oto(oto_dict: dict[str, list[OtoInfo]], cvvc_init
             alternative_info = cvvc_map[alternative_vc]
             new_seg_info: SegmentInfo = alternative_info["seg_info"].replace_phoneme([alternative_c], [consonant])
             
-            generate_articulation_files(alternative_info["wav_file"], new_seg_info, output_dir)
+            alternative_work_list.append((alternative_info["wav_file"], alternative_info["wav_length"], new_seg_info))
         else:
             print("Warning: Could not find alternative VC for %s, skip this line." % vc_name)
 
@@ -516,10 +564,12 @@ def generate_articulation_from_oto(oto_dict: dict[str, list[OtoInfo]], cvvc_init
             alternative_info = cvvc_map[alternative_vr + " -"]
             new_seg_info: SegmentInfo = alternative_info["seg_info"].replace_phoneme([alternative_vr], [vowel])
             
-            generate_articulation_files(alternative_info["wav_file"], new_seg_info, output_dir)
+            alternative_work_list.append((alternative_info["wav_file"], alternative_info["wav_length"], new_seg_info))
         else:
             print("Warning: Could not find alternative VR for %s, skip this line." % vowel)
 
+    run_articulation_work(alternative_work_list, output_dir)
+
 if __name__ == "__main__":
     import sys
     if len(sys.argv) < 3:
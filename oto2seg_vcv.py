@@ -1,48 +1,58 @@
 from __future__ import annotations
 import re
+from operator import itemgetter, le
 from os import path
+from typing import Iterator
 from wave import open as open_wave
 
-from functions import OtoInfo, get_hiragana_info, read_oto
+from functions import OtoInfo, get_hiragana_info, read_oto, write_text_lines
+
+_VCV_HEAD = frozenset("aiueonN-")
+_RE_VCV_ENTRY = re.compile(r"^[\-aiueonN] ([ぁ-ゔァ-・]+)")
 
 def generate_articulation_seg_data(oto_list: list[OtoInfo], wav_length: float) -> list[list[str, float, float]]:
     phoneme_list = []
 
     oto_index = 0
     for oto_item in oto_list:
-        if re.match(r"^[aiueonN] \-", oto_item.alias): # End of sentence
-            phoneme_list.append(['Sil', oto_item.preutterance]) # Preutterance is the end of the previous syllable
-        elif re.match(r"^[\-aiueonN] [ぁ-ゔァ-・]+", oto_item.alias): # VCV entry
-            hatsuon = re.match(r"^[\-aiueonN] ([ぁ-ゔァ-・]+)", oto_item.alias).group(1)
-
-            if hatsuon == "を":
-                continue # Skip を, it's dumplicated with お
-
-            hatsuon_info = get_hiragana_info(hatsuon)
-
-            if not hatsuon_info:
-                print(f"Warning: Could not find hiragana info for {hatsuon}, skipping.")
-                continue
-            
-            phonemes = hatsuon_info["phoneme"].split(" ")
-            phonemes_len = len(phonemes)
-            if phonemes_len == 1:
-                # Monophone
-                phoneme_list.append([phonemes[0], oto_item.preutterance])
-            elif phonemes_len == 2:
-                # Overlap is the start of the consonant, and preutterance is the start of the vowel
-                if phonemes[0] == "h" and oto_index != 0: # Fix は in the middle of a sentence
-                    phonemes[0] = "h\\"
-
-                phoneme_list.append([phonemes[0], oto_item.overlap])
-                phoneme_list.append([phonemes[1], oto_item.preutterance])
-            else:
-                print(f"Warning: Hiragana {hatsuon} has {phonemes_len} phonemes, skipping.")
+        alias = oto_item.alias
+        # Both kinds of entries start with a vowel or "-" followed by a space
+        if len(alias) > 2 and alias[0] in _VCV_HEAD and alias[1] == " ":
+            if alias[2] == "-" and alias[0] != "-": # End of sentence
+                phoneme_list.append(['Sil', oto_item.preutterance]) # Preutterance is the end of the previous syllable
+            elif matches := _RE_VCV_ENTRY.match(alias): # VCV entry
+                hatsuon = matches.group(1)
+
+                if hatsuon == "を":
+                    continue # Skip を, it's dumplicated with お
+
+                hatsuon_info = get_hiragana_info(hatsuon)
+
+                if not hatsuon_info:
+                    print(f"Warning: Could not find hiragana info for {hatsuon}, skipping.")
+                    continue
+
+                phonemes = hatsuon_info["phoneme"].split(" ")
+                phonemes_len = len(phonemes)
+                if phonemes_len == 1:
+                    # Monophone
+                    phoneme_list.append([phonemes[0], oto_item.preutterance])
+                elif phonemes_len == 2:
+                    # Overlap is the start of the consonant, and preutterance is the start of the vowel
+                    if phonemes[0] == "h" and oto_index != 0: # Fix は in the middle of a sentence
+                        phonemes[0] = "h\\"
+
+                    phoneme_list.append([phonemes[0], oto_item.overlap])
+                    phoneme_list.append([phonemes[1], oto_item.preutterance])
+                else:
+                    print(f"Warning: Hiragana {hatsuon} has {phonemes_len} phonemes, skipping.")
 
         oto_index += 1
 
-    # Sort the phoneme list by start time
-    phoneme_list.sort(key=lambda x: x[1])
+    # Sort the phoneme list by start time, oto entries are usually in order already
+    start_times = [phoneme[1] for phoneme in phoneme_list]
+    if not all(map(le, start_times, start_times[1:])):
+        phoneme_list.sort(key=itemgetter(1))
 
     # Add Sil at the start and end
     first_phoneme_start = phoneme_list[0][1]
@@ -50,16 +60,18 @@ def generate_articulation_seg_data(oto_list: list[OtoInfo], wav_length: float) -
         phoneme_list[0][1] = 40
         first_phoneme_start = 40
 
-    phoneme_list.insert(0, ['Sil', 0])
-    phoneme_list.insert(1, ['Sil', first_phoneme_start - 20])
-
     last_phoneme_end = phoneme_list[-1][1]
     if last_phoneme_end > wav_length - 20: # Keep at least 20ms of silence at the end
         phoneme_list[-1][1] = wav_length - 20
         last_phoneme_end = wav_length - 20
 
-    phoneme_list.append(['Sil', last_phoneme_end + 20])
-    phoneme_list.append(['Sil', wav_length])
+    phoneme_list = [
+        ['Sil', 0],
+        ['Sil', first_phoneme_start - 20],
+        *phoneme_list,
+        ['Sil', last_phoneme_end + 20],
+        ['Sil', wav_length],
+    ]
 
     seg_info = []
     for i in range(0, len(phoneme_list) - 1):
@@ -74,41 +86,28 @@ def generate_articulation_seg_data(oto_list: list[OtoInfo], wav_length: float) -
 def xsampa_is_vowel(phoneme: str) -> bool:
     return phoneme in ["a", "i", "M", "e", "o", "N\\"]
 
-def generate_articulation_seg_file(seg_info: list[list[str, float, float]]) -> str:
-    content = [
-        "nPhonemes %d" % len(seg_info),
-        "articulationsAreStationaries = 0",
-        "phoneme		BeginTime		EndTime",
-        "==================================================="
-    ]
+def iter_articulation_seg_lines(seg_info: list[list[str, float, float]]) -> Iterator[str]:
+    yield "nPhonemes %d" % len(seg_info)
+    yield "articulationsAreStationaries = 0"
+    yield "phoneme		BeginTime		EndTime"
+    yield "==================================================="
 
     for phoneme, begin_time, end_time in seg_info:
-        content.append("%s\t\t%.6f\t\t%.6f" % (phoneme, begin_time, end_time))
-
-    return "\n".join(content) + "\n"
+        yield "%s\t\t%.6f\t\t%.6f" % (phoneme, begin_time, end_time)
 
-def generate_articulation_trans_file(seg_info: list[list[str, float, float]]) -> str:
-    content = []
-
-    phoneme_list = []
-    for i in range(1, len(seg_info) - 1):
-        phoneme_list.append(seg_info[i][0])
-    
-    content.append(" ".join(phoneme_list))
+def iter_articulation_trans_lines(seg_info: list[list[str, float, float]]) -> Iterator[str]:
+    yield " ".join(phoneme[0] for phoneme in seg_info[1:-1])
 
     seg_len = len(seg_info)
 
-    i = 2
-    while i < seg_len - 1:
-        if i > 2 and i < seg_len - 2 and not xsampa_is_vowel(seg_info[i][0]): # Force first and second items be Sil-C, C-V
-            content.append("[%s %s %s]" % (seg_info[i - 1][0], seg_info[i][0], seg_info[i + 1][0]))
-            i += 1
+    # Previous, current and next phoneme for each phoneme between the Sil pairs
+    phoneme_iter = enumerate(zip(seg_info[1:], seg_info[2:-1], seg_info[3:]), 2)
+    for i, (prev_phoneme, phoneme, next_phoneme) in phoneme_iter:
+        if i > 2 and i < seg_len - 2 and not xsampa_is_vowel(phoneme[0]): # Force first and second items be Sil-C, C-V
+            yield "[%s %s %s]" % (prev_phoneme[0], phoneme[0], next_phoneme[0])
+            next(phoneme_iter, None) # The next phoneme is covered by this triphone
         else:
-            content.append("[%s %s]" % (seg_info[i - 1][0], seg_info[i][0]))
-
-        i += 1
-
-    return "\n".join(content)
+            yield "[%s %s]" % (prev_phoneme[0], phoneme[0])
 
 def generate_articulation_from_oto(oto_dict: dict[str, list[OtoInfo]], output_dir: str) -> str:
     """Converts an oto.ini dictionary to a .seg file."""
@@ -120,16 +119,12 @@ def generate_articulation_from_oto(oto_dict: dict[str, list[OtoInfo]], output_di
             wav_length = wav_params.nframes / wav_params.framerate * 1000
 
         seg_info = generate_articulation_seg_data(oto_list, wav_length)
-        seg_file_content = generate_articulation_seg_file(seg_info)
 
         seg_file = path.join(output_dir, base_name + ".seg")
-        with open(seg_file, "w", encoding="utf-8") as f:
-            f.write(seg_file_content)
+        write_text_lines(seg_file, iter_articulation_seg_lines(seg_info))
 
-        trans_file_content = generate_articulation_trans_file(seg_info)
         trans_file = path.join(output_dir, base_name + ".trans")
-        with open(trans_file, "w", encoding="utf-8") as f:
-            f.write(trans_file_content)
+        write_text_lines(trans_file, iter_articulation_trans_lines(seg_info), end="")
 
 if __name__ == "__main__":
     import sys
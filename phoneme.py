@@ -22,6 +22,18 @@ consonant_list = ["n", "N", "N'", "J", "m", "m'", "p\\", "p\\'", "s", "S", "h",
                   "dZ", "dz", "ts", "tS", "4", "4'", "p", "p'", "t", "t'", "k", "k'",
                   "b", "b'", "d", "d'", "g", "g'"]
 
+# N variant used before each consonant
+n_variant_map = {}
+for consonant in ["n", "d", "d'", "t", "t'", "4", "4'", "dz", "dZ", "ts", "tS"]:
+    n_variant_map[consonant] = "n"
+for consonant in ["m", "m'", "p", "p'", "b", "b'"]:
+    n_variant_map[consonant] = "m"
+for consonant in ["g", "k"]:
+    n_variant_map[consonant] = "N"
+for consonant in ["g'", "k'"]:
+    n_variant_map[consonant] = "N'"
+n_variant_map["J"] = "J"
+
 unvoiced_consonant_list = ["p\\", "p\\'", "s", "S", "h", "C", "tS", "p", "p'", "t", "t'", "k", "k'"]
 plosive_consonant_list = ["p", "p'", "t", "t'", "k", "k'", "b", "b'", "d", "d'", "g", "g'"]
 
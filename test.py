@@ -1,12 +1,42 @@
+import tempfile
+import wave
+from os import path
+
 from functions import *
 from phoneme import *
+from oto2seg_cvvc import generate_articulation_from_oto
 
 oto_aliases = ["- u", "- う", "- da", "- d", "- だ", "a d", "a n", "n a", "n d", "i n", "a -", "u -", "n -", "にゃ"]
 
 for alias in oto_aliases:
-    oto_item = OtoInfo()
-    oto_item.alias = alias
+    oto_item = OtoInfo(wav_file="", alias=alias, offset=0, consonant=0, cutoff=0, preutterance=0, overlap=0)
 
     phoneme_info = get_oto_entry_phoneme_info(oto_item)
 
-    print("%s: %s" % (alias, phoneme_info.type))
\ No newline at end of file
+    print("%s: %s" % (alias, phoneme_info.type))
+
+def test_missing_vc_fallback():
+    """Converts a voicebank without "a k'", which is generated from "a k" in the alternative pass."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        wav_file = path.join(temp_dir, "_a_ka.wav")
+        with wave.open(wav_file, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(44100)
+            wav.writeframes(b"\0\0" * 44100)
+
+        oto_dict = {
+            "_a_ka.wav": [
+                OtoInfo(wav_file=wav_file, alias="a k", offset=300, consonant=450, cutoff=600, preutterance=400, overlap=350),
+            ],
+        }
+        generate_articulation_from_oto(oto_dict, "rcv", temp_dir)
+
+        for file_name in ["vc_a_k", "vc_a_k'"]:
+            for ext in [".wav", ".seg", ".trans", ".as0"]:
+                assert path.exists(path.join(temp_dir, file_name + ext)), "Missing %s%s" % (file_name, ext)
+
+    print("Missing VC fallback: ok")
+
+if __name__ == "__main__":
+    test_missing_vc_fallback()
\ No newline at end of file